@@ -0,0 +1,11 @@
+# Gunicorn settings for production
+# Every endpoint waits on OpenAI or disk I/O, so gevent workers let one process
+# keep many requests in flight instead of one request per sync worker
+bind = "0.0.0.0:5000"
+worker_class = "gevent"
+# One worker only: the vector index, processing jobs and index files belong to a
+# single LangChainService, and separate processes would diverge and overwrite each other
+workers = 1
+worker_connections = 200
+# Document uploads return immediately, but answers can take a while to generate
+timeout = 120
@@ -1,38 +1,93 @@
 import os
+import time
+import uuid
+import random
 import logging
-from typing import List, Tuple, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple, Optional
 import faiss
 import pickle
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+import numpy as np
+import tiktoken
+import httpx
+from cachetools import TTLCache
+from langchain_community.document_loaders import PyMuPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_openai import OpenAIEmbeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 from langchain_community.vectorstores import FAISS
-from langchain.chains import ConversationalRetrievalChain
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.memory import ConversationBufferMemory
 from langchain.schema import Document
-from openai import OpenAI
+from openai import OpenAI, RateLimitError
+
+# Number of chunks packed into a single embeddings API request
+EMBEDDING_BATCH_SIZE = 128
+# Embedding batches in flight at once, and retries per batch on rate limiting
+EMBEDDING_MAX_WORKERS = 5
+EMBEDDING_MAX_RETRIES = 5
+# On-disk cache of chunk embeddings keyed by content hash
+EMBEDDING_CACHE_FOLDER = "./embed_cache"
+
+# IVF layout: 256 coarse clusters, 32 sub-quantizers of 4 bits in fast-scan layout
+# (16 bytes/vector, distance lookup tables kept in SIMD registers).
+# Training needs a representative sample, so smaller collections stay on a flat index.
+IVF_INDEX_FACTORY = "IVF256,PQ32x4fs"
+IVF_MIN_TRAIN_SIZE = 10000
+IVF_NPROBE = 16
+
+# Files holding the persisted shared index and its docstore. Each save writes a new
+# versioned pair, then the pointer file is switched to it with one atomic rename.
+INDEX_FILENAME = "global_index.{version}.faiss"
+INDEX_STATE_FILENAME = "global_index.{version}.pkl"
+INDEX_POINTER_FILENAME = "global_index.current"
+
+# Token budget for the document text sent to the summary model
+SUMMARY_MAX_TOKENS = 3500
+# Character prefix tokenized for the summary; tokens average well under 8 characters
+SUMMARY_MAX_CHARS = SUMMARY_MAX_TOKENS * 8
+
+# Extractive digest fed to comparisons instead of raw document text
+DIGEST_SENTENCES = 4
+DIGEST_MAX_CHARS = 400
+
+# Comparison results are reused for an hour per (document ids, comparison type)
+COMPARISON_CACHE_SIZE = 128
+COMPARISON_CACHE_TTL = 3600
 
 class LangChainService:
     """Service class for handling LangChain operations"""
     
-    def __init__(self):
+    def __init__(self, index_folder: Optional[str] = None):
         self.openai_api_key = os.environ.get("OPENAI_API_KEY")
         if not self.openai_api_key:
             raise ValueError("OPENAI_API_KEY environment variable is required")
         
-        # Initialize OpenAI client
-        self.openai_client = OpenAI(api_key=self.openai_api_key)
+        # Initialize OpenAI client; one shared client reuses its connection pool across requests
+        self.openai_client = OpenAI(
+            api_key=self.openai_api_key,
+            http_client=httpx.Client(transport=httpx.HTTPTransport(retries=2))
+        )
         
         # Initialize LangChain components
-        self.embeddings = OpenAIEmbeddings(openai_api_key=self.openai_api_key)
-        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-        # do not change this unless explicitly requested by the user
-        self.llm = ChatOpenAI(
-            temperature=0.7,
-            model_name="gpt-4o",
-            openai_api_key=self.openai_api_key
+        openai_embeddings = OpenAIEmbeddings(
+            openai_api_key=self.openai_api_key,
+            chunk_size=EMBEDDING_BATCH_SIZE
+        )
+        # Cache chunk embeddings so repeated content is never embedded twice
+        self.embeddings = CacheBackedEmbeddings.from_bytes_store(
+            openai_embeddings,
+            LocalFileStore(EMBEDDING_CACHE_FOLDER),
+            namespace=openai_embeddings.model,
+            key_encoder="sha256"
         )
         
+        # Tokenizer for budgeting prompt sizes
+        self.tokenizer = tiktoken.encoding_for_model("gpt-4o")
+        
         # Text splitter for chunking documents
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
@@ -40,9 +95,26 @@ class LangChainService:
             length_function=len,
         )
         
-        # Store for document vectors
-        self.vector_stores = {}  # document_id -> FAISS vector store
-        self.document_texts = {}  # document_id -> original text
+        # Single vector store shared by all documents, chunks tagged with doc_id
+        self.global_index: Optional[FAISS] = None
+        self.document_labels: Dict[int, List[int]] = {}  # document_id -> faiss labels of its chunks
+        self.document_digests: Dict[int, str] = {}  # document_id -> extractive digest
+        # Held by writers and by every search, since faiss searches run without the GIL
+        self._index_lock = threading.Lock()
+        # Chunks get increasing faiss labels that are never reused, so removals need no renumbering
+        self._next_label = 0
+        
+        # Persisted index location; a memory-mapped index is read-only until reloaded
+        self.index_folder = index_folder
+        self._mmapped_index_path: Optional[str] = None
+        self._index_version = 0  # version of the latest snapshot taken
+        self._saved_version = 0  # version the pointer file refers to
+        self._save_lock = threading.Lock()
+        self._load_indexes_on_startup()
+        
+        # Recent comparison results
+        self._comparison_cache = TTLCache(maxsize=COMPARISON_CACHE_SIZE, ttl=COMPARISON_CACHE_TTL)
+        self._comparison_lock = threading.Lock()
         
         # Memory for conversations
         self.memory = ConversationBufferMemory(
@@ -53,12 +125,17 @@ class LangChainService:
         
         logging.info("LangChain service initialized")
     
-    def process_document(self, file_path: str, document_id: int) -> Tuple[bool, str]:
-        """Process a document and create vector embeddings"""
+    def process_document(self, file_path: str, document_id: int,
+                         is_document_live: Optional[Callable[[], bool]] = None) -> Tuple[bool, str]:
+        """Process a document and create vector embeddings
+        
+        is_document_live is checked under the index lock just before the vectors are
+        committed, so a document deleted mid-processing never reaches the index.
+        """
         try:
             # Load document based on file type
             if file_path.endswith('.pdf'):
-                loader = PyPDFLoader(file_path)
+                loader = PyMuPDFLoader(file_path)
             elif file_path.endswith('.txt'):
                 loader = TextLoader(file_path, encoding='utf-8')
             else:
@@ -71,16 +148,31 @@ class LangChainService:
             if not texts:
                 return False, "No text content found in document"
             
-            # Store original text for reference
-            full_text = "\n".join([doc.page_content for doc in documents])
-            self.document_texts[document_id] = full_text
-            
-            # Create vector store
-            vector_store = FAISS.from_documents(texts, self.embeddings)
-            self.vector_stores[document_id] = vector_store
+            # Add batched embeddings to the shared vector store
+            page_contents = [text.page_content for text in texts]
+            vectors = np.asarray(self._embed_texts(page_contents), dtype=np.float32)
+            # Unit length vectors make inner product equal to cosine similarity
+            faiss.normalize_L2(vectors)
+            metadatas = [{**text.metadata, "doc_id": document_id} for text in texts]
+            # Keep only a short digest for comparisons, not the full text
+            digest = self._extract_digest(texts)
+            with self._index_lock:
+                if is_document_live and not is_document_live():
+                    return False, "Document was deleted during processing"
+                self._add_to_global_index(document_id, page_contents, vectors, metadatas)
+                self.document_digests[document_id] = digest
+                snapshot = self._snapshot_global_index()
+            self._write_snapshot(snapshot)
             
-            # Generate summary
-            summary = self._generate_summary(full_text)
+            # Generate summary, joining only as many pages as the summary can use
+            summary_pages = []
+            summary_length = 0
+            for doc in documents:
+                summary_pages.append(doc.page_content)
+                summary_length += len(doc.page_content) + 1
+                if summary_length > SUMMARY_MAX_CHARS:
+                    break
+            summary = self._generate_summary("\n".join(summary_pages))
             
             logging.info(f"Successfully processed document {document_id}")
             return True, summary
@@ -89,12 +181,226 @@ class LangChainService:
             logging.error(f"Error processing document {document_id}: {e}")
             return False, f"Processing failed: {str(e)}"
     
+    def remove_document(self, document_id: int):
+        """Drop a document's chunks from the shared vector store"""
+        snapshot = None
+        with self._index_lock:
+            self.document_digests.pop(document_id, None)
+            labels = self.document_labels.pop(document_id, None)
+            if labels:
+                self._remove_from_global_index(labels)
+                snapshot = self._snapshot_global_index()
+        self._write_snapshot(snapshot)
+        
+        # Forget cached comparisons that included this document
+        with self._comparison_lock:
+            for key in list(self._comparison_cache.keys()):
+                if document_id in key[0]:
+                    self._comparison_cache.pop(key, None)
+    
+    def _load_indexes_on_startup(self):
+        """Memory-map the persisted shared index so restarts skip re-embedding"""
+        if not self.index_folder:
+            return
+        
+        pointer_path = os.path.join(self.index_folder, INDEX_POINTER_FILENAME)
+        if not os.path.exists(pointer_path):
+            return
+        
+        try:
+            with open(pointer_path) as f:
+                version = int(f.read().strip())
+            index_path, state_path = self._index_paths(version)
+            
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            self._configure_ivf_search(index)
+            with open(state_path, 'rb') as f:
+                state = pickle.load(f)
+            
+            if index.ntotal != len(state['index_to_docstore_id']):
+                logging.error(f"Vector index {index_path} does not match its docstore, not loading it")
+                return
+            
+            self.global_index = FAISS(
+                embedding_function=self.embeddings,
+                index=index,
+                docstore=state['docstore'],
+                index_to_docstore_id=state['index_to_docstore_id'],
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
+            self.document_labels = state['document_labels']
+            self.document_digests = state.get('document_digests', {})
+            self._next_label = max(state['index_to_docstore_id'], default=-1) + 1
+            self._mmapped_index_path = index_path
+            self._index_version = self._saved_version = version
+            logging.info(f"Loaded vector index with {index.ntotal} vectors from {index_path}")
+        except Exception as e:
+            logging.error(f"Error loading vector index from {self.index_folder}: {e}")
+    
+    def _index_paths(self, version: int) -> Tuple[str, str]:
+        """Paths of the index and docstore files for a saved version"""
+        return (os.path.join(self.index_folder, INDEX_FILENAME.format(version=version)),
+                os.path.join(self.index_folder, INDEX_STATE_FILENAME.format(version=version)))
+    
+    def _snapshot_global_index(self) -> Optional[Tuple[int, np.ndarray, bytes]]:
+        """Serialize the shared index and its docstore; call with the index lock held
+        
+        Snapshots cover the whole index and every chunk's text, so each upload or delete
+        costs serialization time and disk writes in proportion to the library size.
+        """
+        if not self.index_folder or self.global_index is None:
+            return None
+        
+        state = {
+            'docstore': self.global_index.docstore,
+            'index_to_docstore_id': self.global_index.index_to_docstore_id,
+            'document_labels': self.document_labels,
+            'document_digests': self.document_digests,
+        }
+        self._index_version += 1
+        return self._index_version, faiss.serialize_index(self.global_index.index), pickle.dumps(state)
+    
+    def _write_snapshot(self, snapshot: Optional[Tuple[int, np.ndarray, bytes]]):
+        """Write a snapshot to disk outside the index lock and point the index folder at it"""
+        if snapshot is None:
+            return
+        
+        version, index_bytes, state_bytes = snapshot
+        with self._save_lock:
+            # Snapshots can finish out of order; never replace a newer one
+            if version <= self._saved_version:
+                return
+            
+            index_path, state_path = self._index_paths(version)
+            index_bytes.tofile(index_path)
+            with open(state_path, 'wb') as f:
+                f.write(state_bytes)
+            
+            # The index and docstore switch together when the pointer is renamed into place
+            pointer_path = os.path.join(self.index_folder, INDEX_POINTER_FILENAME)
+            with open(pointer_path + ".tmp", 'w') as f:
+                f.write(str(version))
+            os.replace(pointer_path + ".tmp", pointer_path)
+            
+            for old_path in self._index_paths(self._saved_version):
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+            self._saved_version = version
+    
+    def _ensure_writable_index(self):
+        """Replace a memory-mapped index with an in-memory copy before modifying it"""
+        if self._mmapped_index_path:
+            self.global_index.index = faiss.read_index(self._mmapped_index_path)
+            self._configure_ivf_search(self.global_index.index)
+            self._mmapped_index_path = None
+    
+    def _add_to_global_index(self, document_id: int, page_contents: List[str],
+                             vectors: np.ndarray, metadatas: List[dict]):
+        """Append a document's chunk vectors to the shared vector store"""
+        if self.global_index is None:
+            # Vectors are staged in a flat index until there are enough to train IVF-PQ
+            self.global_index = FAISS(
+                embedding_function=self.embeddings,
+                index=faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1])),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
+        self._ensure_writable_index()
+        
+        # index_to_docstore_id is keyed by faiss label rather than by position
+        labels = list(range(self._next_label, self._next_label + len(page_contents)))
+        self._next_label += len(page_contents)
+        chunk_ids = [str(uuid.uuid4()) for _ in page_contents]
+        self.global_index.docstore.add({
+            chunk_id: Document(page_content=page_content, metadata=metadata)
+            for chunk_id, page_content, metadata in zip(chunk_ids, page_contents, metadatas)
+        })
+        self.global_index.index.add_with_ids(vectors, np.asarray(labels, dtype=np.int64))
+        self.global_index.index_to_docstore_id.update(zip(labels, chunk_ids))
+        self.document_labels[document_id] = labels
+        
+        index = self.global_index.index
+        if faiss.try_extract_index_ivf(index) is None and index.ntotal >= IVF_MIN_TRAIN_SIZE:
+            staged_vectors = faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+            trained_index = self._train_ivf_index(staged_vectors)
+            # Labels carry over, so the docstore mapping stays valid
+            trained_index.add_with_ids(staged_vectors, faiss.vector_to_array(index.id_map))
+            self.global_index.index = trained_index
+            logging.info(f"Trained IVF-PQ fast-scan index on {index.ntotal} vectors")
+    
+    def _remove_from_global_index(self, labels: List[int]):
+        """Drop the given chunks from the shared index and its docstore"""
+        self._ensure_writable_index()
+        # Removing by label works on both index types; fast-scan codes cannot be
+        # reconstructed once loaded from disk, so the index is never rebuilt
+        self.global_index.index.remove_ids(faiss.IDSelectorBatch(np.asarray(labels, dtype=np.int64)))
+        mapping = self.global_index.index_to_docstore_id
+        self.global_index.docstore.delete([mapping.pop(label) for label in labels])
+    
+    def _train_ivf_index(self, training_vectors: np.ndarray) -> faiss.Index:
+        """Create an empty IVF-PQ fast-scan inner-product index trained on the given vectors"""
+        dimension = training_vectors.shape[1]
+        index = faiss.index_factory(dimension, IVF_INDEX_FACTORY, faiss.METRIC_INNER_PRODUCT)
+        index.train(training_vectors)
+        self._configure_ivf_search(index)
+        return index
+    
+    def _configure_ivf_search(self, index: faiss.Index):
+        """Apply query-time IVF settings to a trained or loaded index"""
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = IVF_NPROBE
+    
+    def _extract_digest(self, texts: List[Document]) -> str:
+        """Build a short extractive digest from the opening sentences of evenly spaced chunks"""
+        step = max(1, len(texts) // DIGEST_SENTENCES)
+        sentence_chars = DIGEST_MAX_CHARS // DIGEST_SENTENCES
+        
+        sentences = []
+        for text in texts[::step][:DIGEST_SENTENCES]:
+            sentence = " ".join(text.page_content.split()).split(". ")[0]
+            sentences.append(sentence[:sentence_chars])
+        return " ... ".join(sentences)
+    
+    def _embed_texts(self, page_contents: List[str]) -> List[List[float]]:
+        """Embed chunk texts in concurrent batches, preserving their order"""
+        starts = range(0, len(page_contents), EMBEDDING_BATCH_SIZE)
+        batches = [page_contents[start:start + EMBEDDING_BATCH_SIZE] for start in starts]
+        
+        # executor.map yields results in submission order
+        with ThreadPoolExecutor(max_workers=EMBEDDING_MAX_WORKERS) as executor:
+            results = executor.map(self._embed_batch, batches)
+            vectors = []
+            for batch_vectors in results:
+                vectors.extend(batch_vectors)
+        return vectors
+    
+    def _embed_query(self, query: str) -> List[float]:
+        """Embed a search query as a unit vector, matching the normalized index"""
+        query_vector = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+        faiss.normalize_L2(query_vector)
+        return query_vector[0].tolist()
+    
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """Embed a single batch, backing off with jitter when rate limited"""
+        for attempt in range(EMBEDDING_MAX_RETRIES):
+            try:
+                return self.embeddings.embed_documents(batch)
+            except RateLimitError:
+                if attempt == EMBEDDING_MAX_RETRIES - 1:
+                    raise
+                delay = (2 ** attempt) + random.uniform(0, 1)
+                logging.warning(f"Embedding rate limited, retrying in {delay:.1f}s")
+                time.sleep(delay)
+    
     def _generate_summary(self, text: str, max_length: int = 500) -> str:
         """Generate a summary of the document using OpenAI"""
         try:
-            # Truncate text if too long for API
-            if len(text) > 3000:
-                text = text[:3000] + "..."
+            # Truncate text by token count if too long for API, tokenizing only a bounded prefix
+            tokens = self.tokenizer.encode(text[:SUMMARY_MAX_CHARS])
+            if len(tokens) > SUMMARY_MAX_TOKENS or len(text) > SUMMARY_MAX_CHARS:
+                text = self.tokenizer.decode(tokens[:SUMMARY_MAX_TOKENS]) + "..."
             
             prompt = f"""Please provide a concise summary of the following document in about 2-3 sentences. 
             Focus on the main topics, key points, and overall purpose of the document.
@@ -105,7 +411,7 @@ class LangChainService:
             Summary:"""
             
             response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
+                model="gpt-4o-mini",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=150,
                 temperature=0.3
@@ -121,70 +427,113 @@ class LangChainService:
                     conversation_history: List = None) -> Tuple[str, str]:
         """Ask a question about documents or general conversation"""
         try:
-            if document_id and document_id in self.vector_stores:
-                # Question about specific document
-                return self._ask_document_question(question, document_id, conversation_history)
-            elif self.vector_stores:
-                # Question about all documents
-                return self._ask_general_question(question, conversation_history)
-            else:
-                # No documents available, general conversation
-                return self._ask_general_conversation(question, conversation_history)
+            messages, context_used = self._build_question_messages(
+                question, document_id, conversation_history
+            )
+            
+            response = self.openai_client.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7
+            )
+            
+            return response.choices[0].message.content, context_used
                 
         except Exception as e:
             logging.error(f"Error asking question: {e}")
             return f"Sorry, I encountered an error: {str(e)}", ""
     
-    def _ask_document_question(self, question: str, document_id: int, 
-                              conversation_history: List = None) -> Tuple[str, str]:
-        """Ask question about a specific document"""
-        vector_store = self.vector_stores[document_id]
+    def stream_question(self, question: str, document_id: Optional[int] = None,
+                        conversation_history: List = None) -> Tuple[Iterator[str], str]:
+        """Ask a question and yield the answer text as it is generated"""
+        messages, context_used = self._build_question_messages(
+            question, document_id, conversation_history
+        )
+        
+        stream = self.openai_client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=500,
+            temperature=0.7,
+            stream=True
+        )
+        
+        def answer_chunks():
+            try:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                # Closing the generator early also stops the generation upstream
+                stream.close()
+        
+        return answer_chunks(), context_used
+    
+    def _build_question_messages(self, question: str, document_id: Optional[int] = None,
+                                 conversation_history: List = None) -> Tuple[List[dict], str]:
+        """Build chat messages and the context used for a question"""
+        if document_id and document_id in self.document_labels:
+            # Question about specific document
+            return self._document_question_messages(question, document_id, conversation_history)
+        elif self.document_labels:
+            # Question about all documents
+            return self._general_question_messages(question, conversation_history)
+        else:
+            # No documents available, general conversation
+            return self._general_conversation_messages(question, conversation_history)
+    
+    def _document_question_messages(self, question: str, document_id: int, 
+                                    conversation_history: List = None) -> Tuple[List[dict], str]:
+        """Build messages for a question about a specific document"""
+        # Retrieve context for the question as asked, restricted to this document's chunks
+        query_vector = np.asarray([self._embed_query(question)], dtype=np.float32)
+        with self._index_lock:
+            store = self.global_index
+            selector = faiss.IDSelectorBatch(np.asarray(self.document_labels[document_id], dtype=np.int64))
+            ivf = faiss.try_extract_index_ivf(store.index)
+            if ivf is None:
+                params = faiss.SearchParameters(sel=selector)
+            else:
+                # The document's chunks can sit in any list, so probe them all
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nlist)
+            _, labels = store.index.search(query_vector, 3, params=params)
+            source_documents = [store.docstore.search(store.index_to_docstore_id[label])
+                                for label in labels[0].tolist() if label >= 0]
+        context = "\n\n".join([doc.page_content for doc in source_documents])
         
-        # Create retrieval chain
-        retriever = vector_store.as_retriever(search_kwargs={"k": 3})
+        messages = [
+            {"role": "system", "content": "You are a helpful research assistant. Answer questions using the provided document context. If the context does not contain the answer, say so."}
+        ]
         
-        # Build conversation history for context
-        chat_history = []
+        # Add conversation history
         if conversation_history:
             for conv in reversed(conversation_history[:5]):  # Last 5 conversations
-                chat_history.append((conv.question, conv.answer))
-        
-        # Create conversational retrieval chain
-        qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=retriever,
-            return_source_documents=True,
-            verbose=True
-        )
+                messages.append({"role": "user", "content": conv.question})
+                messages.append({"role": "assistant", "content": conv.answer})
         
-        # Ask question
-        result = qa_chain({
-            "question": question,
-            "chat_history": chat_history
-        })
+        # Add current question with retrieved context
+        messages.append({"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"})
         
         # Extract context from source documents
-        context_used = ""
-        if result.get("source_documents"):
-            context_used = "\n".join([doc.page_content[:200] + "..." 
-                                    for doc in result["source_documents"]])
+        context_used = "\n".join([doc.page_content[:200] + "..." 
+                                  for doc in source_documents])
         
-        return result["answer"], context_used
+        return messages, context_used
     
-    def _ask_general_question(self, question: str, conversation_history: List = None) -> Tuple[str, str]:
-        """Ask question across all available documents"""
-        if not self.vector_stores:
-            return self._ask_general_conversation(question, conversation_history)
-        
-        # Combine all vector stores for search
-        all_docs = []
-        for doc_id, vector_store in self.vector_stores.items():
-            # Get relevant docs from each vector store
-            docs = vector_store.similarity_search(question, k=2)
-            all_docs.extend(docs)
+    def _general_question_messages(self, question: str,
+                                   conversation_history: List = None) -> Tuple[List[dict], str]:
+        """Build messages for a question across all available documents"""
+        if not self.document_labels:
+            return self._general_conversation_messages(question, conversation_history)
+        
+        # Search the shared vector store across all documents
+        query_vector = self._embed_query(question)
+        with self._index_lock:
+            all_docs = self.global_index.similarity_search_by_vector(query_vector, k=5)
         
         if not all_docs:
-            return self._ask_general_conversation(question, conversation_history)
+            return self._general_conversation_messages(question, conversation_history)
         
         # Create context from all relevant documents
         context = "\n".join([doc.page_content for doc in all_docs[:5]])
@@ -208,17 +557,11 @@ class LangChainService:
         
         Please provide a helpful and accurate answer based on the available information."""
         
-        response = self.openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=500,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content, context[:500]
+        return [{"role": "user", "content": prompt}], context[:500]
     
-    def _ask_general_conversation(self, question: str, conversation_history: List = None) -> Tuple[str, str]:
-        """Handle general conversation without document context"""
+    def _general_conversation_messages(self, question: str,
+                                       conversation_history: List = None) -> Tuple[List[dict], str]:
+        """Build messages for general conversation without document context"""
         # Build conversation history
         messages = [
             {"role": "system", "content": "You are a helpful research assistant. You can answer questions and have conversations, but you work best when provided with documents to analyze."}
@@ -233,24 +576,26 @@ class LangChainService:
         # Add current question
         messages.append({"role": "user", "content": question})
         
-        response = self.openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content, ""
+        return messages, ""
     
     def compare_documents(self, documents: List, comparison_type: str = 'similarities') -> str:
         """Compare multiple documents"""
         try:
+            cache_key = (tuple(sorted(doc.id for doc in documents)), comparison_type)
+            with self._comparison_lock:
+                cached = self._comparison_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
             document_summaries = []
             document_contents = []
+            # Documents still being processed are left out, so that comparison is not cached
+            cacheable = all(doc.id in self.document_digests and doc.summary for doc in documents)
             
             for doc in documents:
-                if doc.id in self.document_texts:
-                    content = self.document_texts[doc.id][:2000]  # First 2000 chars
+                if doc.id in self.document_digests:
+                    # Precomputed digest instead of the raw document text
+                    content = self.document_digests[doc.id]
                     document_contents.append(f"Document: {doc.original_filename}\n{content}")
                     document_summaries.append(f"- {doc.original_filename}: {doc.summary}")
             
@@ -266,7 +611,7 @@ class LangChainService:
 Document Summaries:
 {chr(10).join(document_summaries)}
 
-Full Content Analysis:
+Key Excerpts:
 {chr(10).join(document_contents)}
 
 Provide a comprehensive comparison covering:
@@ -281,7 +626,11 @@ Provide a comprehensive comparison covering:
                 temperature=0.7
             )
             
-            return response.choices[0].message.content
+            comparison = response.choices[0].message.content
+            if cacheable:
+                with self._comparison_lock:
+                    self._comparison_cache[cache_key] = comparison
+            return comparison
             
         except Exception as e:
             logging.error(f"Error comparing documents: {e}")
@@ -290,31 +639,51 @@ Provide a comprehensive comparison covering:
     def search_documents(self, query: str) -> List[dict]:
         """Search across all documents using semantic similarity"""
         try:
-            results = []
-            
-            for doc_id, vector_store in self.vector_stores.items():
-                # Get document info
-                from models import Document
-                document = Document.query.get(doc_id)
-                if not document:
-                    continue
-                
-                # Search in this document
-                similar_docs = vector_store.similarity_search_with_score(query, k=3)
-                
-                for doc, score in similar_docs:
-                    results.append({
-                        'document_id': doc_id,
-                        'document_name': document.original_filename,
-                        'content': doc.page_content[:300] + "...",
-                        'similarity_score': float(score),
-                        'relevance': 'High' if score < 0.5 else 'Medium' if score < 1.0 else 'Low'
-                    })
-            
-            # Sort by similarity score (lower is better for FAISS)
-            results.sort(key=lambda x: x['similarity_score'])
-            
-            return results[:10]  # Return top 10 results
+            if self.global_index is None:
+                return []
+            
+            # Single search over all documents against the raw FAISS index.
+            # The index and its docstore mapping change together under the lock.
+            query_vector = np.asarray([self._embed_query(query)], dtype=np.float32)
+            with self._index_lock:
+                store = self.global_index
+                scores, labels = store.index.search(query_vector, 30)
+                found = labels[0] >= 0
+                chunks = [store.docstore.search(store.index_to_docstore_id[label])
+                          for label in labels[0][found].tolist()]
+            
+            # Order best first and tier relevance in one pass
+            scores = scores[0][found]
+            order = np.argsort(-scores)
+            scores = scores[order]
+            chunks = [chunks[rank] for rank in order.tolist()]
+            # Scores are cosine similarities, higher is better
+            relevance = np.where(scores > 0.8, 'High', np.where(scores > 0.6, 'Medium', 'Low'))
+            
+            # Get document info for every matched document in one query
+            from models import Document
+            doc_ids = {chunk.metadata['doc_id'] for chunk in chunks}
+            documents = {document.id: document
+                         for document in Document.query.filter(Document.id.in_(doc_ids)).all()}
+            
+            # Keep at most 3 chunks per document
+            selected = []
+            per_document = {}
+            for rank, chunk in enumerate(chunks):
+                doc_id = chunk.metadata['doc_id']
+                if doc_id in documents and per_document.get(doc_id, 0) < 3:
+                    per_document[doc_id] = per_document.get(doc_id, 0) + 1
+                    selected.append(rank)
+            
+            score_values = scores.tolist()
+            relevance_values = relevance.tolist()
+            return [{
+                'document_id': chunks[rank].metadata['doc_id'],
+                'document_name': documents[chunks[rank].metadata['doc_id']].original_filename,
+                'content': chunks[rank].page_content[:300] + "...",
+                'similarity_score': score_values[rank],
+                'relevance': relevance_values[rank]
+            } for rank in selected[:10]]  # Return top 10 results
             
         except Exception as e:
             logging.error(f"Error searching documents: {e}")
@@ -9,7 +9,7 @@ class Document(db.Model):
     original_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     file_type = db.Column(db.String(50), nullable=False)
-    upload_time = db.Column(db.DateTime, default=datetime.utcnow)
+    upload_time = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     processed = db.Column(db.Boolean, default=False)
     summary = db.Column(db.Text)
     
@@ -27,8 +27,8 @@ class Document(db.Model):
 class Conversation(db.Model):
     """Model for storing conversation history"""
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.String(255), nullable=False)
-    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=True)
+    session_id = db.Column(db.String(36), nullable=False)  # UUID4 string
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=True, index=True)
     question = db.Column(db.Text, nullable=False)
     answer = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -36,6 +36,11 @@ class Conversation(db.Model):
     
     document = db.relationship('Document', backref='conversations')
     
+    __table_args__ = (
+        # Session history lookups filter on session_id and order by timestamp
+        db.Index('ix_conv_session_ts', 'session_id', 'timestamp'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -1,16 +1,54 @@
 import os
 import uuid
-import json
+import orjson
 from datetime import datetime
-from flask import render_template, request, jsonify, session, current_app
+from concurrent.futures import ThreadPoolExecutor
+from flask import render_template, request, jsonify, session, current_app, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
+from sqlalchemy.orm import selectinload
 from app import app, db
 from models import Document, Conversation
 from langchain_service import LangChainService
 import logging
 
+try:
+    from gevent import get_hub
+    from gevent.monkey import is_module_patched
+    from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+except ImportError:  # gevent is only installed for the production server
+    is_module_patched = None
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for faster request and response serialization"""
+    
+    def dumps(self, obj, **kwargs):
+        # Honor the same options as the default provider; any indent becomes two spaces
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+# Serialize jsonify responses and parse request bodies with orjson
+app.json = ORJSONProvider(app)
+
 # Initialize LangChain service
-langchain_service = LangChainService()
+langchain_service = LangChainService(index_folder=app.config['UPLOAD_FOLDER'])
+
+# Background workers for document processing and removal. PDF parsing, tokenizing,
+# IVF training and index snapshots are CPU-bound, so under gevent they run on native
+# threads instead of greenlets that would block every request in the worker
+use_native_threads = bool(is_module_patched and is_module_patched('threading'))
+if use_native_threads:
+    processing_executor = NativeThreadPoolExecutor(max_workers=2)
+else:
+    processing_executor = ThreadPoolExecutor(max_workers=2)
+processing_jobs = {}  # document_id -> Future for documents still being processed
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'txt', 'pdf'}
@@ -20,6 +58,87 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def process_document_task(file_path, document_id):
+    """Process an uploaded document off the request thread and record the result"""
+    def is_document_live():
+        return db.session.query(Document.id).filter_by(id=document_id).first() is not None
+    
+    with app.app_context():
+        success, summary = langchain_service.process_document(
+            file_path,
+            document_id,
+            is_document_live=is_document_live
+        )
+        if not success:
+            logging.error(f"Failed to process document {document_id}: {summary}")
+            return False
+        
+        document = Document.query.get(document_id)
+        if document:
+            document.processed = True
+            document.summary = summary
+            db.session.commit()
+            logging.info(f"Document {document_id} processed successfully")
+        return True
+
+def start_processing(file_path, document_id):
+    """Queue a document for background processing and track it until the job finishes"""
+    job = processing_executor.submit(process_document_task, file_path, document_id)
+    processing_jobs[document_id] = job
+    
+    def forget_job(finished_job):
+        # Runs after the task has committed its result, or at once if it already has
+        if processing_jobs.get(document_id) is finished_job:
+            processing_jobs.pop(document_id, None)
+    
+    job.add_done_callback(forget_job)
+
+def remove_document_vectors(document_id):
+    """Drop a document's vectors without queueing behind documents still being processed"""
+    if use_native_threads:
+        # The hub's own native pool keeps the event loop free while the index is saved
+        get_hub().threadpool.spawn(langchain_service.remove_document, document_id).get()
+    else:
+        langchain_service.remove_document(document_id)
+
+# Appended to answers cut short by a client disconnect, so later prompts see them as partial
+INTERRUPTED_ANSWER_MARKER = " [interrupted]"
+
+def stream_answer(answer_chunks, context_used, session_id, question, document_id):
+    """Yield answer chunks as server-sent events and save the conversation once streaming ends"""
+    answer_parts = []
+    
+    def save_conversation(suffix=""):
+        conversation = Conversation(
+            session_id=session_id,
+            document_id=document_id,
+            question=question,
+            answer="".join(answer_parts) + suffix,
+            context_used=context_used
+        )
+        db.session.add(conversation)
+        db.session.commit()
+        return conversation
+    
+    try:
+        for chunk in answer_chunks:
+            answer_parts.append(chunk)
+            yield f"data: {app.json.dumps({'chunk': chunk})}\n\n"
+    except GeneratorExit:
+        # The client disconnected; stop generating and keep what it was shown, marked as partial
+        answer_chunks.close()
+        if answer_parts:
+            save_conversation(INTERRUPTED_ANSWER_MARKER)
+        raise
+    except Exception as e:
+        # A failed generation is reported but never saved as a truncated answer
+        logging.error(f"Answer streaming error: {e}")
+        yield f"data: {app.json.dumps({'error': f'Failed to process question: {str(e)}'})}\n\n"
+        return
+    
+    conversation = save_conversation()
+    yield f"data: {app.json.dumps({'done': True, 'conversation': conversation.to_dict()})}\n\n"
+
 @app.route('/')
 def index():
     """Main page route"""
@@ -30,8 +149,10 @@ def index():
     # Get uploaded documents
     documents = Document.query.order_by(Document.upload_time.desc()).all()
     
-    # Get conversation history for this session
-    conversations = Conversation.query.filter_by(
+    # Get conversation history for this session, loading linked documents up front
+    conversations = Conversation.query.options(
+        selectinload(Conversation.document)
+    ).filter_by(
         session_id=session['session_id']
     ).order_by(Conversation.timestamp.asc()).all()
     
@@ -77,29 +198,47 @@ def upload_file():
         db.session.add(document)
         db.session.commit()
         
-        # Process document with LangChain
-        try:
-            success, summary = langchain_service.process_document(file_path, document.id)
-            if success:
-                document.processed = True
-                document.summary = summary
-                db.session.commit()
-                logging.info(f"Document {document.id} processed successfully")
-            else:
-                logging.error(f"Failed to process document {document.id}: {summary}")
-        except Exception as e:
-            logging.error(f"Error processing document: {e}")
+        # Process document with LangChain in the background
+        start_processing(file_path, document.id)
         
         return jsonify({
             'success': True,
-            'message': 'File uploaded successfully',
+            'message': 'File uploaded successfully, processing started',
+            'document_id': document.id,
+            'status': 'processing',
             'document': document.to_dict()
-        }), 200
+        }), 202
         
     except Exception as e:
         logging.error(f"Upload error: {e}")
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
+@app.route('/document_status/<int:document_id>')
+def document_status(document_id):
+    """Get processing status of an uploaded document"""
+    try:
+        # Checked before loading the row: a job is only forgotten after its result is committed
+        in_progress = document_id in processing_jobs
+        document = Document.query.get_or_404(document_id)
+        
+        if document.processed:
+            status = 'processed'
+        elif in_progress:
+            status = 'processing'
+        else:
+            # Finished without marking the document, or lost to a restart
+            status = 'failed'
+        
+        return jsonify({
+            'success': True,
+            'document_id': document_id,
+            'status': status,
+            'document': document.to_dict()
+        })
+    except Exception as e:
+        logging.error(f"Error getting document status: {e}")
+        return jsonify({'error': 'Failed to get document status'}), 500
+
 @app.route('/ask', methods=['POST'])
 def ask_question():
     """Handle question asking"""
@@ -122,6 +261,18 @@ def ask_question():
             session_id=session_id
         ).order_by(Conversation.timestamp.desc()).limit(10).all()
         
+        # Stream the answer as server-sent events when the client asks for it
+        if data.get('stream'):
+            answer_chunks, context_used = langchain_service.stream_question(
+                question,
+                document_id,
+                conversation_history
+            )
+            return app.response_class(
+                stream_with_context(stream_answer(answer_chunks, context_used, session_id, question, document_id)),
+                mimetype='text/event-stream'
+            )
+        
         # Ask question using LangChain service
         answer, context_used = langchain_service.ask_question(
             question, 
@@ -211,11 +362,20 @@ def delete_document(document_id):
         if os.path.exists(document.file_path):
             os.remove(document.file_path)
         
+        # Skip processing that has not started yet
+        job = processing_jobs.pop(document_id, None)
+        if job:
+            job.cancel()
+        
         # Delete from database
         Conversation.query.filter_by(document_id=document_id).delete()
         db.session.delete(document)
         db.session.commit()
         
+        # Drop document vectors from the search index. This runs after the commit, so a
+        # worker still processing the document either sees it deleted or is undone here.
+        remove_document_vectors(document_id)
+        
         return jsonify({'success': True, 'message': 'Document deleted successfully'})
     except Exception as e:
         logging.error(f"Error deleting document: {e}")